@@ -2,7 +2,82 @@ from __future__ import division
 import numpy as np
 from scipy.spatial.distance import cosine
 import keras.backend as K
+from keras.callbacks import Callback
 
+# Numba is an optional dependency; when present, add_noise uses a compiled
+# parallel kernel in place of the pure-NumPy path.
+try:
+    import numba
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+if _HAS_NUMBA:
+    @numba.njit(parallel=True)
+    def _xor_bits(x, mask):
+        # x and mask are flattened, contiguous uint8 arrays of 0/1 bits.
+        # The Bernoulli mask is drawn by the caller with NumPy so that the
+        # experiment seed governs it; only the XOR runs in compiled code.
+        out = np.empty_like(x)
+        for i in numba.prange(x.shape[0]):
+            out[i] = x[i] ^ mask[i]
+        return out
+
+
+class BestWeightsCheckpoint(Callback):
+    """
+    A Keras callback that keeps an in-memory copy of the best model weights
+    seen during training. This is a drop-in replacement for ModelCheckpoint
+    when the model is small: rather than serializing the weights to an HDF5
+    file every time the monitored quantity improves, we simply stash a copy
+    of model.get_weights() (a list of numpy arrays) in RAM, which is cheap
+    enough to do every epoch.
+    :param monitor: (str) the quantity from the epoch logs to monitor.
+    """
+    def __init__(self, monitor='loss'):
+        super(BestWeightsCheckpoint, self).__init__()
+        self.monitor = monitor
+        self.best = np.inf
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = logs.get(self.monitor)
+        if current is not None and current < self.best:
+            self.best = current
+            self.best_weights = self.model.get_weights()
+
+    def restore(self, model):
+        """
+        Load the best recorded weights back into the model.
+        :param model: (Keras Sequential) The model to restore.
+        """
+        if self.best_weights is not None:
+            model.set_weights(self.best_weights)
+
+def add_noise(X, p):
+    """
+    Return a copy of a binary feature matrix in which each bit has been
+    flipped independently with probability p. The bits are packed 8-per-byte
+    with np.packbits so that the Bernoulli mask can be applied as a single
+    bytewise XOR rather than flipping booleans element by element. If Numba
+    is installed, the XOR is applied by a compiled parallel kernel instead.
+    The mask is always drawn from NumPy's global random state, so results
+    are reproducible under np.random.seed and identical on both paths.
+    :param X: (Numpy array) the binary feature matrix.
+    :param p: (float) the probability with which each bit is flipped.
+    :return: (Numpy array) a noisy copy of X with the same shape and dtype.
+    """
+    if p <= 0.:
+        return X.copy()
+    if _HAS_NUMBA:
+        bits = np.ascontiguousarray(X, dtype=np.uint8).ravel()
+        mask = (np.random.rand(*X.shape) < p).astype(np.uint8).ravel()
+        return _xor_bits(bits, mask).reshape(X.shape).astype(X.dtype)
+    X_packed = np.packbits(X.astype(np.uint8), axis=-1)
+    mask = np.packbits(np.random.rand(*X.shape) < p, axis=-1)
+    X_noisy = np.unpackbits(X_packed ^ mask, axis=-1)[..., :X.shape[-1]]
+
+    return X_noisy.astype(X.dtype)
 
 def similarity(x1, x2, measure='cosine'):
     assert measure in ['cosine', 'euclidean']
@@ -60,32 +135,23 @@ def get_hidden_representations(model, X, layer_num, batch_size=32):
     # Concatenate the list of arrays and return
     return np.concatenate(outputs)
 
-def evaluate_generalization(model, X, layer_num, batch_size=32):
+def score_trials(X_p):
     """
-    Evaluate a trained Keras model on a set of novel objects. The novel objects
-    come in groupings of 4, where each grouping contains an exemplar sample, a
-    shape-match sample, a color-match sample, and a texture-match
-    sample. For each grouping, we find which of the 3 match samples is most
-    similar to the exemplar sample according to the model's internal features.
-    Then, we compute the fraction of times that it was the correct (shape
-    match) sample.
-    :param model: (Keras Sequential) The Keras model to be used for evaluation.
-    :param X: (Numpy array) The input data.
-    :param layer_num: (int) The index of the layer whose representation will be
-                        used for similarity evaluation
-    :param batch_size: (int) The batch size to use when evaluating the model
-                        on a set of inputs.
-    :return: (tuple) For each of the 3 match types, the fraction of groupings in
-                    which the sample of the particular match was selected.
+    Score a set of pre-computed feature representations for generalization
+    trials. The representations come in groupings of 4, where each grouping
+    contains an exemplar sample, a shape-match sample, a color-match sample,
+    and a texture-match sample. For each grouping, we find which of the 3
+    match samples is most similar to the exemplar sample.
+    :param X_p: (Numpy array) The feature representations of the trials.
+    :return: (dict) For each of the 3 match types, the fraction of groupings
+                    in which the sample of the particular match was selected.
     """
-    # Since we have groupings of 4 samples, X should have a length that is a
-    # multiple of 4.
-    assert len(X) % 4 == 0
-    X_p = get_hidden_representations(model, X, layer_num=layer_num,
-                                     batch_size=batch_size)
+    # Since we have groupings of 4 samples, X_p should have a length that is
+    # a multiple of 4.
+    assert len(X_p) % 4 == 0
     # keep a count of the # times each match is selected (indexed 0,1,3)
     counts = {0:0, 1:0, 2:0}
-    for i in range(int(len(X)/4)):
+    for i in range(int(len(X_p)/4)):
         scores = np.zeros(3)
         scores[0] = similarity(X_p[4*i], X_p[4*i+1]) # shape match score
         scores[1] = similarity(X_p[4*i], X_p[4*i+2]) # color match score
@@ -101,13 +167,33 @@ def evaluate_generalization(model, X, layer_num, batch_size=32):
 
     # Compute the percentages for each of the 3 match types
     gen_scores = {
-        'shape': counts[0] / (len(X)/4.),
-        'color': counts[1] / (len(X)/4.),
-        'texture': counts[2] / (len(X)/4.)
+        'shape': counts[0] / (len(X_p)/4.),
+        'color': counts[1] / (len(X_p)/4.),
+        'texture': counts[2] / (len(X_p)/4.)
     }
 
     return gen_scores
 
+def evaluate_generalization(model, X, layer_num, batch_size=32):
+    """
+    Evaluate a trained Keras model on a set of novel objects, presented as
+    groupings of 4 (exemplar, shape match, color match, texture match). The
+    model's internal features are computed for each sample and the groupings
+    are then scored with score_trials.
+    :param model: (Keras Sequential) The Keras model to be used for evaluation.
+    :param X: (Numpy array) The input data.
+    :param layer_num: (int) The index of the layer whose representation will be
+                        used for similarity evaluation
+    :param batch_size: (int) The batch size to use when evaluating the model
+                        on a set of inputs.
+    :return: (dict) For each of the 3 match types, the fraction of groupings in
+                    which the sample of the particular match was selected.
+    """
+    X_p = get_hidden_representations(model, X, layer_num=layer_num,
+                                     batch_size=batch_size)
+
+    return score_trials(X_p)
+
 def train_model(
         model, X_train, Y_train, epochs, validation_data, batch_size,
         checkpoint, burn_period=20
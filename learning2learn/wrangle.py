@@ -36,9 +36,10 @@ def synthesize_data(nb_categories, nb_exemplars):
 def generate_bit_dictionary(nb_categories, nb_bits=20):
     min_bits = int(np.ceil(math.log(nb_categories, 2)))
     assert nb_bits >= min_bits
-    # the candidate vectors
+    # the candidate vectors; stored as uint8 since they are just bits
     candidates = np.asarray(
-        [seq for seq in itertools.product([0, 1], repeat=nb_bits)]
+        [seq for seq in itertools.product([0, 1], repeat=nb_bits)],
+        dtype=np.uint8
     )
     # the candidates that we will use are randomly selected
     ix = np.random.choice(
@@ -59,7 +60,7 @@ def build_test_trials_O1_bits(
         color_set_test, texture_set_train, texture_set_test, nb_trials
 ):
     nb_bits = len(shape_set_train[0])
-    X_test = np.zeros((4 * nb_trials, 3 * nb_bits))
+    X_test = np.zeros((4 * nb_trials, 3 * nb_bits), dtype=np.uint8)
     for i in range(nb_trials):
         # First sample the baseline from the training set
         ix = np.random.choice(range(len(df_train)), 1)[0]
@@ -88,7 +89,7 @@ def build_test_trials_O1_bits(
 
 def build_test_trials_O2_bits(shape_set, color_set, texture_set, nb_trials):
     nb_bits = len(shape_set[0])
-    X_test = np.zeros((4 * nb_trials, 3 * nb_bits))
+    X_test = np.zeros((4 * nb_trials, 3 * nb_bits), dtype=np.uint8)
     for i in range(nb_trials):
         # randomly select 3 of each feature
         s1, s2, s3 = np.random.choice(range(len(shape_set)), 3, replace=False)
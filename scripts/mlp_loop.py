@@ -1,15 +1,32 @@
 from __future__ import division, print_function
 import os
-import sys
 import shutil
 import warnings
 import argparse
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 
 from mlp_train_one import run_experiment
 
+def run_cell(nb_categories, nb_exemplars, params, results_path):
+    # Worker entry point for a single (nb_categories, nb_exemplars) grid
+    # cell. Each worker redirects its prints to a per-cell log file so that
+    # output from concurrent cells doesn't interleave. A single large write
+    # buffer keeps the many small prints inside run_experiment from turning
+    # into one syscall apiece, and redirect_stdout restores stdout even if
+    # the experiment raises.
+    log_file = os.path.join(results_path,
+                            'log_ca%0.4i_ex%0.4i' %
+                            (nb_categories, nb_exemplars))
+    with open(log_file, 'w', buffering=1 << 20) as f:
+        with contextlib.redirect_stdout(f):
+            result = run_experiment(nb_categories, nb_exemplars, params)
+
+    return result
+
 def experiment_loop(category_trials, exemplar_trials, params, results_path):
-    stdout = sys.stdout
     # Create results_path folder. Remove previous one if it already exists.
     if os.path.isdir(results_path):
         warnings.warn('Removing old results folder of the same name!')
@@ -19,29 +36,44 @@ def experiment_loop(category_trials, exemplar_trials, params, results_path):
             np.asarray(category_trials))
     np.save(os.path.join(results_path, 'exemplar_trials.npy'),
             np.asarray(exemplar_trials))
-    # Loop through different values of (nb_categories, nb_exemplars)
-    results_O1 = np.zeros(
-        shape=(len(category_trials), len(exemplar_trials), params['nb_runs'])
+    # Loop through different values of (nb_categories, nb_exemplars). The
+    # results arrays are memory-mapped .npy files created up front, so
+    # checkpointing a finished cell is an in-place assignment plus flush
+    # rather than a rewrite of the whole array.
+    results_shape = (
+        len(category_trials), len(exemplar_trials), params['nb_runs']
     )
-    results_O2 = np.zeros(
-        shape=(len(category_trials), len(exemplar_trials), params['nb_runs'])
+    results_O1 = np.lib.format.open_memmap(
+        os.path.join(results_path, 'results_O1.npy'), mode='w+',
+        dtype=np.float64, shape=results_shape
     )
-    for i, nb_categories in enumerate(category_trials):
-        for j, nb_exemplars in enumerate(exemplar_trials):
-            print('Testing for %i categories and %i exemplars...' %
-                  (nb_categories, nb_exemplars))
-            log_file = os.path.join(results_path,
-                                    'log_ca%0.4i_ex%0.4i' %
-                                    (nb_categories, nb_exemplars))
-            sys.stdout = open(log_file,'w')
-            results_O1[i, j], results_O2[i, j] = \
-                run_experiment(nb_categories, nb_exemplars, params)
-            sys.stdout = stdout
-            # Save results from this run to text file
-            save_file_gen = os.path.join(results_path, 'results_O1.npy')
-            np.save(save_file_gen, results_O1)
-            save_file_gen = os.path.join(results_path, 'results_O2.npy')
-            np.save(save_file_gen, results_O2)
+    results_O2 = np.lib.format.open_memmap(
+        os.path.join(results_path, 'results_O2.npy'), mode='w+',
+        dtype=np.float64, shape=results_shape
+    )
+    # Each grid cell is an independent experiment, so we farm the cells out
+    # to a pool of worker processes. With multiple workers, each one is
+    # restricted to a single TF thread so that they don't oversubscribe the
+    # CPU cores.
+    if params['nb_workers'] > 1:
+        params = dict(params, nb_threads=1)
+    with ProcessPoolExecutor(max_workers=params['nb_workers']) as executor:
+        futures = {}
+        for i, nb_categories in enumerate(category_trials):
+            for j, nb_exemplars in enumerate(exemplar_trials):
+                future = executor.submit(
+                    run_cell, nb_categories, nb_exemplars, params,
+                    results_path
+                )
+                futures[future] = (i, j)
+        for future in as_completed(futures):
+            i, j = futures[future]
+            results_O1[i, j], results_O2[i, j] = future.result()
+            print('Completed %i categories and %i exemplars...' %
+                  (category_trials[i], exemplar_trials[j]))
+            # Flush so completed cells survive a crash mid-loop
+            results_O1.flush()
+            results_O2.flush()
     print('Experiment loop complete.')
 
 def main():
@@ -50,7 +82,10 @@ def main():
         'nb_epochs': args.nb_epochs,
         'batch_size': args.batch_size,
         'nb_runs': args.nb_runs,
-        'nb_test': 1000
+        'nb_test': 1000,
+        'nb_workers': args.nb_workers,
+        'noise': args.noise,
+        'reuse_graph': args.reuse_graph
     }
     # Start the experiment loop
     category_trials = [2, 4, 8, 16, 32, 50]
@@ -75,9 +110,21 @@ if __name__ == '__main__':
     parser.add_argument('-b', '--batch_size',
                         help='Int indicating the batch size to use',
                         required=False, type=int)
+    parser.add_argument('-w', '--nb_workers',
+                        help='The number of parallel worker processes',
+                        required=False, type=int)
+    parser.add_argument('-n', '--noise',
+                        help='Bit-flip probability for training set noise',
+                        required=False, type=float)
+    parser.add_argument('--reuse_graph',
+                        help='Build each model graph once and re-initialize '
+                             'weights between runs',
+                        required=False, action='store_true')
     parser.set_defaults(nb_epochs=200)
     parser.set_defaults(save_path='../results/mlp_results')
     parser.set_defaults(nb_runs=10)
     parser.set_defaults(batch_size=32)
+    parser.set_defaults(nb_workers=mp.cpu_count())
+    parser.set_defaults(noise=0.)
     args = parser.parse_args()
     main()
\ No newline at end of file
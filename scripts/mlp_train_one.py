@@ -4,8 +4,6 @@ import argparse
 import numpy as np
 import tensorflow as tf
 import keras.backend as K
-from keras.callbacks import ModelCheckpoint
-from sklearn.preprocessing import OneHotEncoder
 
 from learning2learn.models import simple_mlp
 from learning2learn.wrangle import synthesize_data
@@ -15,7 +13,13 @@ from learning2learn.wrangle import build_test_trials_O1_bits
 from learning2learn.wrangle import build_test_trials_O2_bits
 from learning2learn.util import train_model
 from learning2learn.util import train_test_split
-from learning2learn.util import evaluate_generalization
+from learning2learn.util import get_hidden_representations
+from learning2learn.util import score_trials
+from learning2learn.util import BestWeightsCheckpoint
+from learning2learn.util import add_noise
+
+# This model is too small to benefit from GPU; make sure TF never touches it.
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
 
 
 def run_experiment(nb_categories, nb_exemplars, params, target='shape'):
@@ -25,96 +29,116 @@ def run_experiment(nb_categories, nb_exemplars, params, target='shape'):
         params['batch_size'],
         int(np.floor(nb_categories * nb_exemplars / 5))
     )
-    # Create custom TF session... we won't use GPU for this model.
+    # Create custom TF session... we won't use GPU for this model. When the
+    # experiment is run inside a pool of workers, 'nb_threads' limits the TF
+    # thread pools (0 means use the system default).
+    nb_threads = params.get('nb_threads', 0)
     sess = tf.Session(
-        config=tf.ConfigProto(device_count={'GPU': 0})
+        config=tf.ConfigProto(
+            device_count={'GPU': 0},
+            intra_op_parallelism_threads=nb_threads,
+            inter_op_parallelism_threads=nb_threads
+        )
     )
     K.set_session(sess)
     # Set random seed
     np.random.seed(0)
+    # Get the shape, color, and texture parameters for the training and
+    # testing sets. Features will be drawn from these parameter sets for
+    # each sample. These only depend on the random seed, not on the
+    # training set of a particular run, so they are built once and shared
+    # by all runs.
+    (shape_set_train, shape_set_test), \
+    (color_set_train, color_set_test), \
+    (texture_set_train, texture_set_test) = \
+        get_train_test_parameters(images=False, nb_bits=20)
+    if nb_categories < 50:
+        shape_set_train, _ = train_test_split(
+            shape_set_train,
+            50 - nb_categories
+        )
+        color_set_train, _ = train_test_split(
+            color_set_train,
+            50 - nb_categories
+        )
+        texture_set_train, _ = train_test_split(
+            texture_set_train,
+            50 - nb_categories
+        )
+    # The o2 test trials are drawn entirely from the held-out parameter
+    # sets, so they too can be hoisted out of the runs loop
+    print('Building test trials...')
+    X_test_O2 = build_test_trials_O2_bits(
+        shape_set_test, color_set_test, texture_set_test,
+        nb_trials=params['nb_test']
+    )
     # Allocate space for storing results
     scores_O1 = np.zeros(params['nb_runs'])
     scores_O2 = np.zeros(params['nb_runs'])
+    model = None
     for i in range(params['nb_runs']):
         print('Round #%i' % (i+1))
         # Build the training set
         print('Building the training set...')
         df_train = synthesize_data(nb_categories, nb_exemplars)
         labels = df_train[target].values
-        ohe = OneHotEncoder(sparse=False)
-        Y_train = ohe.fit_transform(labels.reshape(-1, 1))
-        # Get the shape, color, and texture parameters for the training and
-        # testing sets. Features will be drawn from these parameter sets for
-        # each sample
-        (shape_set_train, shape_set_test), \
-        (color_set_train, color_set_test), \
-        (texture_set_train, texture_set_test) = \
-            get_train_test_parameters(images=False, nb_bits=20)
-        if nb_categories < 50:
-            shape_set_train, _ = train_test_split(
-                shape_set_train,
-                50 - nb_categories
-            )
-            color_set_train, _ = train_test_split(
-                color_set_train,
-                50 - nb_categories
-            )
-            texture_set_train, _ = train_test_split(
-                texture_set_train,
-                50 - nb_categories
-            )
+        # One-hot encode the integer labels with a single indexing op
+        Y_train = np.eye(nb_categories, dtype=np.float32)[labels.astype(np.intp)]
         X_train = build_train_set_bits(
             df_train, shape_set_train, color_set_train,
             texture_set_train
         )
-        # Build the o1 test set trials
-        print('Building test trials...')
+        # Optionally corrupt the training bits with Bernoulli noise; a fresh
+        # noise mask is drawn for each run
+        if params.get('noise', 0.) > 0.:
+            X_train = add_noise(X_train, p=params['noise'])
+        # Build the o1 test set trials. Unlike the o2 trials, these sample
+        # their baselines from this run's training set, so they must be
+        # rebuilt every run.
         X_test_O1 = build_test_trials_O1_bits(
             df_train, shape_set_train, shape_set_test, color_set_train,
             color_set_test, texture_set_train, texture_set_test,
             nb_trials=params['nb_test']
         )
-        # Build the o2 test set trials
-        X_test_O2 = build_test_trials_O2_bits(
-            shape_set_test, color_set_test, texture_set_test,
-            nb_trials=params['nb_test']
-        )
-        # Build a neural network model and train it with the training set
-        model = simple_mlp(
-            nb_in=X_train.shape[-1],
-            nb_classes=Y_train.shape[-1]
-        )
+        # Build a neural network model and train it with the training set.
+        # With reuse_graph, the model is built once and its weights (and
+        # optimizer state) are re-initialized in place between runs,
+        # skipping the repeated graph construction.
+        if model is None or not params.get('reuse_graph', False):
+            model = simple_mlp(
+                nb_in=X_train.shape[-1],
+                nb_classes=Y_train.shape[-1]
+            )
+        else:
+            sess.run(tf.global_variables_initializer())
         # We're going to keep track of the best model throughout training,
-        # monitoring the training loss
-        weights_file = '../data/mlp.h5'
-        if os.path.isfile(weights_file):
-            os.remove(weights_file)
-        checkpoint = ModelCheckpoint(
-            weights_file,
-            monitor='loss',
-            save_best_only=True,
-            save_weights_only=True,
-            period=2
-        )
+        # monitoring the training loss. The best weights are kept in memory;
+        # writing them to HDF5 every couple of epochs would dominate the
+        # wall time for a model this small.
+        checkpoint = BestWeightsCheckpoint(monitor='loss')
         # We'll provide the test set as 'validation data' merely so we can
         # monitor the trajectory... the network won't be using this data.
+        # The bits are kept as uint8 until here; cast to float32 only at the
+        # Keras boundary.
         train_model(
-            model, X_train, Y_train, epochs=params['nb_epochs'],
+            model, X_train.astype(np.float32), Y_train,
+            epochs=params['nb_epochs'],
             validation_data=None, batch_size=batch_size,
             checkpoint=checkpoint, burn_period=50
         )
         # Now that we've completed all training epochs, let's go ahead and
-        # load the best model
-        model.load_weights(weights_file)
-        # Now evaluate the model on the test data
-        score_O1 = evaluate_generalization(
-            model, X_test_O1, layer_num=-3,
-            batch_size=128
-        )
-        score_O2 = evaluate_generalization(
-            model, X_test_O2, layer_num=-3,
-            batch_size=128
+        # restore the best model
+        checkpoint.restore(model)
+        # Now evaluate the model on the test data. The o1 and o2 trials are
+        # pushed through the network together in one predict pass, then the
+        # features are split back apart for scoring.
+        X_p = get_hidden_representations(
+            model,
+            np.concatenate((X_test_O1, X_test_O2)).astype(np.float32),
+            layer_num=-3, batch_size=256
         )
+        score_O1 = score_trials(X_p[:len(X_test_O1)])
+        score_O2 = score_trials(X_p[len(X_test_O1):])
         scores_O1[i] = score_O1[target]
         scores_O2[i] = score_O2[target]
     K.clear_session()
@@ -129,7 +153,9 @@ def main():
         'nb_epochs': args.nb_epochs,
         'batch_size': args.batch_size,
         'nb_runs': args.nb_runs,
-        'nb_test': 1000
+        'nb_test': 1000,
+        'noise': args.noise,
+        'reuse_graph': args.reuse_graph
     }
     _ = run_experiment(args.nb_categories, args.nb_exemplars, params)
 
@@ -151,10 +177,18 @@ if __name__ == '__main__':
     parser.add_argument('-b', '--batch_size',
                         help='Int indicating the batch size to use',
                         required=False, type=int)
+    parser.add_argument('-n', '--noise',
+                        help='Bit-flip probability for training set noise',
+                        required=False, type=float)
+    parser.add_argument('--reuse_graph',
+                        help='Build the model graph once and re-initialize '
+                             'weights between runs',
+                        required=False, action='store_true')
     parser.set_defaults(nb_epochs=200)
     parser.set_defaults(nb_categories=10)
     parser.set_defaults(nb_exemplars=5)
     parser.set_defaults(nb_runs=10)
     parser.set_defaults(batch_size=32)
+    parser.set_defaults(noise=0.)
     args = parser.parse_args()
     main()
\ No newline at end of file